@@ -1,24 +1,151 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+import hashlib
+import io
+import logging
+import logging.handlers
 import os
+import queue
+import re
+import threading
+from functools import lru_cache
 from dotenv import load_dotenv
-import requests
-import base64
+from cachetools import TTLCache
+import orjson
+import pybase64
+import httpx
 from groq import Groq
+from semantic_cache import SemanticCache, is_sensitive
+
+# =========================================================
+# LOGGING
+# =========================================================
+# Los handlers de petición solo encolan; un hilo aparte escribe en stderr,
+# así ningún worker espera al lock de la terminal.
+logger = logging.getLogger(__name__)
+_log_queue = queue.SimpleQueue()
+
+
+def _start_log_listener():
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logging.handlers.QueueListener(_log_queue, handler).start()
+
+
+logging.getLogger().addHandler(logging.handlers.QueueHandler(_log_queue))
+logging.getLogger().setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+_start_log_listener()
+# El hilo del listener no sobrevive al fork de gunicorn --preload
+os.register_at_fork(after_in_child=_start_log_listener)
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON de Flask (jsonify, request.get_json) sobre orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # orjson ya produce bytes: se evita el paso intermedio por str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
 
 load_dotenv()
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Blueprint si lo usas
 try:
     from generate_rdf import rdf_bp
     app.register_blueprint(rdf_bp)
-except:
-    pass
+except ImportError as e:
+    logger.warning("Blueprint RDF no disponible: %s", e)
 
 SPEECH_API_KEY = os.getenv("SPEECH_API_KEY")
 
+# Tiempo máximo (s) que un worker espera a Google STT o a Groq.
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 30))
+
+# Cliente gRPC único: envía el audio como protobuf binario sobre HTTP/2
+# (sin base64 en JSON) y reutiliza el canal entre peticiones.
+_speech_client = None
+_groq_client = None
+_clients_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def speech_api():
+    """Importa google-cloud-speech (gRPC) solo cuando se usa por primera vez.
+
+    Es la dependencia más pesada de la app; /process y /rdf no la necesitan
+    y así no alargan el arranque.
+    """
+    # Bajo gunicorn -k gevent, gRPC debe ceder el control al bucle de gevent
+    # en vez de bloquear el worker completo.
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("socket"):
+            from grpc.experimental import gevent as grpc_gevent
+            grpc_gevent.init_gevent()
+    except ImportError:
+        pass
+
+    from google.cloud import speech_v1p1beta1 as speech
+    return speech
+
+
+def get_speech_client():
+    """Crea el cliente de Speech en el primer uso de cada proceso.
+
+    Con gunicorn --preload la app se importa en el master antes del fork, y
+    un canal gRPC abierto ahí no se puede compartir con los workers.
+    """
+    global _speech_client
+    if _speech_client is None:
+        with _clients_lock:
+            if _speech_client is None:
+                _speech_client = speech_api().SpeechClient(client_options={"api_key": SPEECH_API_KEY})
+    return _speech_client
+
+
+# Pool HTTP compartido para Groq: keep-alive y sesiones TLS reutilizadas
+# en lugar de un handshake nuevo por petición.
+_http_client = httpx.Client(
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)
+)
+
+GROQ_MODEL = "llama-3.3-70b-versatile"
+SYSTEM_PROMPT = (
+    "Eres un asistente turístico de PerúGo. "
+    "Responde siempre en español en texto plano."
+)
+# Mismo objeto en cada petición: solo se construye el turno del usuario.
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
+# Caché semántica de respuestas; el namespace (modelo + prompt) invalida
+# las entradas cuando cambia el prompt de sistema.
+_llm_cache = SemanticCache(namespace=f"{GROQ_MODEL}\n{SYSTEM_PROMPT}")
+# Delante de la semántica, una caché exacta en memoria (texto normalizado):
+# las preguntas repetidas ni siquiera calculan el embedding.
+_llm_exact_cache = TTLCache(maxsize=1024, ttl=60 * 60)
+_llm_exact_cache_lock = threading.Lock()
+
+
+def get_groq_client():
+    """Cliente Groq único por proceso, o None si falta GROQ_API_KEY."""
+    global _groq_client
+    if _groq_client is None and os.getenv("GROQ_API_KEY"):
+        with _clients_lock:
+            if _groq_client is None:
+                _groq_client = Groq(http_client=_http_client, timeout=UPSTREAM_TIMEOUT, max_retries=1)
+    return _groq_client
+
 @app.route("/")
 def home():
     return jsonify({"message": "Servidor backend operativo."})
@@ -29,72 +156,175 @@ def home():
 # =========================================================
 # EN app.py
 
+# (desplazamiento, firma, encoding de Google). WAV: "RIFF....WAVE".
+_AUDIO_MAGIC = (
+    (8, b'WAVE', "LINEAR16"),              # iOS
+    (0, b'#!AMR-WB', "AMR_WB"),            # Android
+    (0, b'\x1A\x45\xDF\xA3', "WEBM_OPUS"),  # Web
+    (0, b'ID3', "MP3"),
+    (0, b'\xff\xfb', "MP3"),
+    (0, b'\xff\xf3', "MP3"),
+    (0, b'\xff\xf2', "MP3"),
+)
+
+
+def detect_audio_encoding(audio_bytes: bytes):
+    """Devuelve el encoding de Google STT según la firma del archivo."""
+    header = memoryview(audio_bytes)[:12]
+    for offset, magic, encoding in _AUDIO_MAGIC:
+        if header[offset:offset + len(magic)] == magic:
+            return encoding
+
+    # Si llega .m4a entra aquí y falla porque Google no acepta MP3 para ese formato
+    logger.warning("Formato no reconocido (header: %s). Intentando MP3.", header.hex())
+    return "MP3"
+
+
+# WAV PCM (~32 KB/s a 16 kHz) por encima de este tamaño se recodifica a Opus
+# (~4 KB/s) antes de subirlo a Google.
+OPUS_TRANSCODE_MIN_BYTES = 128 * 1024
+
+
+def linear16_to_webm_opus(audio_bytes: bytes):
+    """Recodifica un WAV PCM a WebM/Opus mono de 16 kHz, en memoria."""
+    import av  # solo se necesita para WAV grandes
+
+    out = io.BytesIO()
+    with av.open(io.BytesIO(audio_bytes), format="wav") as src, \
+            av.open(out, mode="w", format="webm") as dst:
+        stream = dst.add_stream("libopus", rate=16000, layout="mono")
+        # libopus exige tramas de 20 ms (320 muestras a 16 kHz)
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=16000, frame_size=320)
+
+        for frame in src.decode(audio=0):
+            for chunk in resampler.resample(frame):
+                dst.mux(stream.encode(chunk))
+        for chunk in resampler.resample(None):
+            dst.mux(stream.encode(chunk))
+        dst.mux(stream.encode(None))
+
+    return out.getvalue()
+
+
+# Transcripciones por huella del audio: los reintentos y reenvíos idénticos
+# de la app móvil no vuelven a llamar a Google.
+_stt_cache = TTLCache(maxsize=4096, ttl=60 * 60)
+_stt_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def recognition_config(encoding):
+    """RecognitionConfig por encoding, construido una sola vez por proceso."""
+    speech = speech_api()
+    return speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding[encoding],
+        sample_rate_hertz=16000,
+        language_code="es-PE",
+        enable_automatic_punctuation=True,
+    )
+
+
+@lru_cache(maxsize=None)
+def streaming_config(encoding):
+    return speech_api().StreamingRecognitionConfig(config=recognition_config(encoding))
+
+
+# Tamaño de cada trama enviada a streaming_recognize
+STT_FRAME_BYTES = 16 * 1024
+
+
+def _audio_frames(audio_bytes: bytes):
+    request_cls = speech_api().StreamingRecognizeRequest
+    for start in range(0, len(audio_bytes), STT_FRAME_BYTES):
+        yield request_cls(
+            audio_content=audio_bytes[start:start + STT_FRAME_BYTES]
+        )
+
+
 def google_stt_raw_bytes(audio_bytes: bytes):
-    header = audio_bytes[:12]
-    
+    digest = hashlib.blake2b(audio_bytes, digest_size=32).digest()
+    with _stt_cache_lock:
+        cached = _stt_cache.get(digest)
+    if cached is not None:
+        return cached
+
+    transcript = _recognize_audio(audio_bytes)
+
+    if transcript is not None:
+        with _stt_cache_lock:
+            _stt_cache[digest] = transcript
+    return transcript
+
+
+def _recognize_audio(audio_bytes: bytes):
     # 1. Detección de formato (Backend)
-    if header.startswith(b'RIFF') and b'WAVE' in header:
-        encoding = "LINEAR16"  # iOS
-    elif header.startswith(b'#!AMR-WB'):
-        encoding = "AMR_WB"    # Android
-    elif header.startswith(b'\x1A\x45\xDF\xA3'):
-        encoding = "WEBM_OPUS" # Web
-    else:
-        # Si llega .m4a entra aquí y falla porque Google no acepta MP3 para ese formato
-        print(f"⚠️ Formato no reconocido (Header: {header.hex()}). Intentando MP3.")
-        encoding = "MP3"
-
-    print(f"📊 Encoding seleccionado: {encoding}")
-    print(f"kb Recibidos: {len(audio_bytes)/1024:.2f} KB")
-
-    audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
-
-    payload = {
-        "config": {
-            "encoding": encoding,
-            "sampleRateHertz": 16000,
-            "languageCode": "es-PE",
-            "enableAutomaticPunctuation": True,
-        },
-        "audio": {
-            "content": audio_b64
-        }
-    }
+    encoding = detect_audio_encoding(audio_bytes)
+
+    if encoding == "LINEAR16" and len(audio_bytes) > OPUS_TRANSCODE_MIN_BYTES:
+        try:
+            audio_bytes = linear16_to_webm_opus(audio_bytes)
+            encoding = "WEBM_OPUS"
+        except Exception as e:
+            logger.warning("No se pudo recodificar a Opus, se envía LINEAR16: %s", e)
 
-    url = f"https://speech.googleapis.com/v1/speech:recognize?key={SPEECH_API_KEY}"
+    logger.debug("STT encoding=%s size=%d", encoding, len(audio_bytes))
 
-    # 2. Llamada a la API (ESTO FALTABA EN TU CÓDIGO)
+    # 2. Llamada a la API (gRPC en streaming: Google reconoce mientras sube el audio)
     try:
-        response = requests.post(url, json=payload, timeout=30)
-        
-        if response.status_code != 200:
-            print(f"❌ Error Google STT ({response.status_code}): {response.text}")
-            return None
-            
-        result_json = response.json()
-        
+        responses = get_speech_client().streaming_recognize(
+            config=streaming_config(encoding),
+            requests=_audio_frames(audio_bytes),
+            timeout=UPSTREAM_TIMEOUT,
+        )
+
+        transcripts = [
+            result.alternatives[0].transcript.strip()
+            for response in responses
+            for result in response.results
+            if result.is_final and result.alternatives
+        ]
+
         # Validar si hay transcripción
-        if "results" not in result_json:
-            print("⚠️ Google no devolvió resultados (audio vacío o ininteligible)")
+        if not transcripts:
+            logger.info("Google no devolvió resultados (audio vacío o ininteligible)")
             return "" # Devolver cadena vacía para indicar "silencio"
-            
-        transcript = result_json["results"][0]["alternatives"][0]["transcript"]
-        return transcript
+
+        return " ".join(transcripts)
 
     except Exception as e:
-        print(f"❌ Excepción en request: {str(e)}")
+        logger.error("Error Google STT: %s", e)
         return None
+
 # =========================================================
 # RUTA STT BASE64
 # =========================================================
+def read_request_audio():
+    """Lee el audio de la petición una sola vez y sin copias intermedias.
+
+    Con JSON se usa cache=False para que Flask no guarde ni el cuerpo ni el
+    dict parseado, y el string base64 se suelta en cuanto se decodifica.
+    Con multipart se lee directamente el stream del archivo 'audio'.
+    """
+    data = request.get_json(silent=True, cache=False)
+
+    # Caso 1: JSON con audio_base64
+    if data and "audio_base64" in data:
+        return pybase64.b64decode(data.pop("audio_base64"), validate=False)
+
+    # Caso 2: multipart/form-data con archivo 'audio'
+    if "audio" in request.files:
+        return request.files["audio"].stream.read()
+
+    return None
+
+
 @app.route("/stt_base64", methods=["POST"])
 def stt_base64():
-    data = request.get_json()
+    audio_bytes = read_request_audio()
 
-    if not data or "audio_base64" not in data:
+    if audio_bytes is None:
         return jsonify({"error": "audio_base64 no proporcionado"}), 400
 
-    audio_bytes = base64.b64decode(data["audio_base64"])
     text = google_stt_raw_bytes(audio_bytes)
 
     if text is None:
@@ -106,29 +336,154 @@ def stt_base64():
 # =========================================================
 # RUTA STS (AUDIO → TEXTO → LLM)
 # =========================================================
+def _groq_messages(user_text):
+    return [_SYSTEM_MSG, {"role": "user", "content": user_text}]
+
+
+def _normalize_prompt(user_text):
+    return " ".join(user_text.lower().split())
+
+
+def _cached_reply(user_text):
+    """Busca la respuesta primero en la caché exacta y luego en la semántica.
+
+    Devuelve (respuesta o None, embedding del prompt) para que _store_reply
+    no vuelva a calcular el embedding tras un fallo.
+    """
+    key = _normalize_prompt(user_text)
+    with _llm_exact_cache_lock:
+        reply = _llm_exact_cache.get(key)
+    if reply is not None:
+        return reply, None
+
+    emb = _llm_cache.embed(user_text)
+    reply = _llm_cache.get(user_text, emb)
+    if reply is not None:
+        with _llm_exact_cache_lock:
+            _llm_exact_cache[key] = reply
+    return reply, emb
+
+
+def _store_reply(user_text, reply, emb=None):
+    if not is_sensitive(user_text):
+        with _llm_exact_cache_lock:
+            _llm_exact_cache[_normalize_prompt(user_text)] = reply
+    _llm_cache.put(user_text, reply, emb)
+
+
+def _log_groq_usage(usage):
+    """Registra cuántos tokens del prompt sirvió la caché de prefijos de Groq."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    logger.debug(
+        "Groq usage prompt=%s cached=%s completion=%s",
+        getattr(usage, "prompt_tokens", None),
+        getattr(details, "cached_tokens", 0) if details else 0,
+        getattr(usage, "completion_tokens", None),
+    )
+
+
 def call_groq_llm(user_text):
+    cached, emb = _cached_reply(user_text)
+    if cached is not None:
+        return cached
+
+    client = get_groq_client()
+    if client is None:
+        logger.error("Error Groq: GROQ_API_KEY no configurada")
+        return "Error con LLM"
+
     try:
-        client = Groq()
         completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Eres un asistente turístico de PerúGo. "
-                        "Responde siempre en español en texto plano."
-                    )
-                },
-                {"role": "user", "content": user_text}
-            ],
+            model=GROQ_MODEL,
+            messages=_groq_messages(user_text),
             temperature=0.5
         )
-        return completion.choices[0].message.content.strip()
+        reply = completion.choices[0].message.content.strip()
+        _log_groq_usage(completion.usage)
 
     except Exception as e:
-        print("Error Groq:", e)
+        logger.error("Error Groq: %s", e)
         return "Error con LLM"
 
+    # Una respuesta vacía no se cachea: serviría "" a los siguientes prompts.
+    if reply:
+        _store_reply(user_text, reply, emb)
+    return reply
+
+
+def stream_groq_llm(user_text):
+    """Igual que call_groq_llm pero va entregando los tokens según llegan."""
+    cached, emb = _cached_reply(user_text)
+    if cached is not None:
+        yield cached
+        return
+
+    client = get_groq_client()
+    if client is None:
+        logger.error("Error Groq: GROQ_API_KEY no configurada")
+        yield "Error con LLM"
+        return
+
+    parts = []
+    try:
+        completion = client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=_groq_messages(user_text),
+            temperature=0.5,
+            stream=True
+        )
+        for chunk in completion:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+
+    except Exception as e:
+        logger.error("Error Groq: %s", e)
+        if not parts:
+            yield "Error con LLM"
+        return
+
+    reply = "".join(parts).strip()
+    if reply:
+        _store_reply(user_text, reply, emb)
+
+
+# =========================================================
+# STREAMING (SSE)
+# =========================================================
+def _wants_stream():
+    """El cliente pide streaming con ?stream=1 o Accept: text/event-stream."""
+    return (
+        request.args.get("stream") == "1"
+        or request.accept_mimetypes.best == "text/event-stream"
+    )
+
+
+# Fin de frase: signo de cierre seguido de espacio (así "3.5" no corta).
+_SENTENCE_END = re.compile(r"[.!?…]+\s+")
+
+
+def _pop_sentences(buffer):
+    """Separa las frases ya completas del texto que aún está llegando."""
+    sentences, start = [], 0
+    for m in _SENTENCE_END.finditer(buffer):
+        sentences.append(buffer[start:m.end()].strip())
+        start = m.end()
+    return sentences, buffer[start:]
+
+
+def _sse_event(payload):
+    return f"data: {app.json.dumps(payload)}\n\n"
+
+
+def _sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 @app.route("/process", methods=["POST"])
 def process_text():
@@ -138,6 +493,14 @@ def process_text():
     if not user_text:
         return jsonify({"text_response": "Texto vacío"}), 400
 
+    if _wants_stream():
+        def events():
+            for delta in stream_groq_llm(user_text):
+                yield _sse_event({"delta": delta})
+            yield _sse_event({"done": True})
+
+        return _sse_response(events())
+
     llm_text = call_groq_llm(user_text)
 
     return jsonify({
@@ -149,19 +512,8 @@ def process_text():
 
 @app.route("/sts", methods=["POST"])
 def sts():
-    # Intentar leer JSON de forma silenciosa (para evitar 415 si no es application/json)
-    data = request.get_json(silent=True)
-
-    audio_bytes = None
-
-    # Caso 1: JSON con audio_base64
-    if data and "audio_base64" in data:
-        audio_bytes = base64.b64decode(data["audio_base64"])
-
-    # Caso 2: multipart/form-data con archivo 'audio'
-    elif "audio" in request.files:
-        audio_file = request.files["audio"]
-        audio_bytes = audio_file.read()
+    # JSON silencioso (evita 415 si no es application/json) o multipart
+    audio_bytes = read_request_audio()
 
     if audio_bytes is None:
         return jsonify({"error": "audio o audio_base64 requerido"}), 400
@@ -171,6 +523,25 @@ def sts():
     if stt_text is None:
         return jsonify({"error": "Fallo en STT"}), 500
 
+    if _wants_stream():
+        # El texto reconocido sale de inmediato y la respuesta del LLM
+        # se va enviando token a token. Además, cada frase completa sale
+        # como evento "sentence" para que el cliente empiece a sintetizar
+        # la voz mientras el LLM sigue generando.
+        def events():
+            yield _sse_event({"stt_text": stt_text, "action": "none"})
+            pending = ""
+            for delta in stream_groq_llm(stt_text):
+                yield _sse_event({"delta": delta})
+                sentences, pending = _pop_sentences(pending + delta)
+                for sentence in sentences:
+                    yield _sse_event({"sentence": sentence})
+            if pending.strip():
+                yield _sse_event({"sentence": pending.strip()})
+            yield _sse_event({"done": True})
+
+        return _sse_response(events())
+
     llm_text = call_groq_llm(stt_text)
 
     return jsonify({
@@ -182,4 +553,5 @@ def sts():
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    # Solo desarrollo; en producción se usa gunicorn (ver gunicorn.conf.py)
+    app.run(host="0.0.0.0", port=port, debug=os.getenv("FLASK_DEBUG") == "1")
@@ -0,0 +1,31 @@
+# backend/gunicorn.conf.py
+# Servidor de producción: `gunicorn app:app` lee este archivo automáticamente.
+# Las rutas (STT, Groq, MySQL) pasan casi todo el tiempo esperando red, así
+# que usamos workers gevent: cada worker atiende cientos de peticiones a la vez.
+import importlib
+import os
+
+# Con preload_app el master importa la app una sola vez (dotenv, clientes,
+# modelo de embeddings) y los workers la heredan por fork, compartiendo esas
+# páginas de memoria. gevent tiene que parchear antes de esa importación.
+from gevent import monkey
+monkey.patch_all()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = "gevent"
+# Ajustables por entorno (WEB_CONCURRENCY es la variable estándar de gunicorn)
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", 1000))
+timeout = 120
+preload_app = True
+
+
+def when_ready(server):
+    """Importa google-cloud-speech en el master, antes del fork.
+
+    app.py la carga de forma perezosa (speech_api()) para no alargar el
+    arranque en desarrollo; aquí los workers la heredan ya importada y
+    comparten esas páginas. init_gevent() y el cliente gRPC siguen creándose
+    dentro de cada worker.
+    """
+    importlib.import_module("google.cloud.speech_v1p1beta1")
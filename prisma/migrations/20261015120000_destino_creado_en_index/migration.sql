@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX `Destino_creadoEn_idx` ON `Destino`(`creadoEn`);
@@ -0,0 +1,179 @@
+# backend/semantic_cache.py
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+try:
+    import sqlite_vec
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    sqlite_vec = None
+    SentenceTransformer = None
+
+try:
+    from gevent import get_hub, monkey
+except ImportError:
+    get_hub = monkey = None
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Configuración
+# -------------------------------
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+MAX_DISTANCE = 0.15          # distancia coseno máxima para considerar un acierto
+TTL_SECONDS = 24 * 60 * 60   # las respuestas caducan a las 24 h
+# La búsqueda compara el embedding con todas las filas del namespace, así que
+# se conservan solo las más recientes.
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 2000))
+
+# Correos, números de documento/teléfono/tarjeta: no se cachean.
+_SENSITIVE_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+|\d{7,}")
+
+
+def _load_model():
+    """Carga el modelo de embeddings multilingüe una sola vez (al importar)."""
+    if SentenceTransformer is None:
+        logger.warning("sentence-transformers/sqlite-vec no instalados, caché semántica desactivada")
+        return None
+    try:
+        return SentenceTransformer(EMBEDDING_MODEL)
+    except Exception as e:
+        logger.warning("No se pudo cargar %s, caché semántica desactivada: %s", EMBEDDING_MODEL, e)
+        return None
+
+
+_model = _load_model()
+
+
+def _encode(text):
+    """Embedding de `text`; bajo gevent se calcula en el threadpool del hub.
+
+    Es trabajo de CPU: hecho en línea bloquearía todas las peticiones del worker.
+    """
+    if monkey is not None and monkey.is_module_patched("socket"):
+        return get_hub().threadpool.apply(_model.encode, (text,))
+    return _model.encode(text)
+
+
+def is_sensitive(text):
+    """Indica si el texto contiene datos personales que no deben guardarse."""
+    return bool(_SENSITIVE_RE.search(text))
+
+
+# -------------------------------
+# Caché semántica sobre sqlite-vec
+# -------------------------------
+class SemanticCache:
+    """Caché de respuestas del LLM indexada por similitud de embeddings.
+
+    `namespace` separa entradas de distintos prompts de sistema: si el prompt
+    cambia, las respuestas antiguas dejan de coincidir.
+    """
+
+    def __init__(self, namespace, path=CACHE_PATH):
+        self.namespace = hashlib.sha256(namespace.encode("utf-8")).hexdigest()
+        self._path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._failed = _model is None
+
+    def _conn(self):
+        """Conexión SQLite propia de cada proceso (no se hereda por fork)."""
+        if self._pid != os.getpid():
+            self._db = self._open(self._path)
+            self._pid = os.getpid()
+            self._failed = self._db is None
+        return self._db
+
+    @staticmethod
+    def _open(path):
+        try:
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.enable_load_extension(True)
+            sqlite_vec.load(db)
+            db.enable_load_extension(False)
+            db.execute("PRAGMA journal_mode=WAL;")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " emb BLOB NOT NULL,"
+                " reply TEXT NOT NULL,"
+                " ts REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_ns_ts ON cache(namespace, ts);")
+            db.commit()
+            return db
+        except Exception as e:
+            logger.warning("No se pudo abrir la caché semántica en %s: %s", path, e)
+            return None
+
+    @property
+    def enabled(self):
+        return not self._failed
+
+    def embed(self, text):
+        """Embedding de `text` (bytes) para get/put, o None si no se cachea."""
+        if not self.enabled or is_sensitive(text):
+            return None
+        return _encode(text).tobytes()
+
+    def get(self, text, emb=None):
+        """Devuelve la respuesta cacheada más cercana a `text`, o None.
+
+        `emb` es el resultado de embed(text), si ya se calculó.
+        """
+        if emb is None:
+            emb = self.embed(text)
+        if emb is None:
+            return None
+
+        with self._lock:
+            db = self._conn()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT reply, vec_distance_cosine(emb, ?) AS distance FROM cache"
+                " WHERE namespace = ? AND ts >= ?"
+                " ORDER BY distance LIMIT 1;",
+                (emb, self.namespace, time.time() - TTL_SECONDS),
+            ).fetchone()
+
+        if row and row[1] < MAX_DISTANCE:
+            return row[0]
+        return None
+
+    def put(self, text, reply, emb=None):
+        """Guarda la respuesta del LLM para `text` (salvo prompts sensibles)."""
+        if emb is None:
+            emb = self.embed(text)
+        if emb is None:
+            return
+
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            if db is None:
+                return
+            db.execute(
+                "DELETE FROM cache WHERE namespace = ? AND ts < ?;",
+                (self.namespace, now - TTL_SECONDS),
+            )
+            db.execute(
+                "INSERT INTO cache(namespace, emb, reply, ts) VALUES (?, ?, ?, ?);",
+                (self.namespace, emb, reply, now),
+            )
+            # Recorta a las MAX_ENTRIES más recientes (usa el índice cache_ns_ts).
+            db.execute(
+                "DELETE FROM cache WHERE rowid IN ("
+                " SELECT rowid FROM cache WHERE namespace = ?"
+                " ORDER BY ts DESC LIMIT -1 OFFSET ?);",
+                (self.namespace, MAX_ENTRIES),
+            )
+            db.commit()